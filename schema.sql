@@ -1,6 +1,7 @@
 DROP TABLE IF EXISTS movies;
 DROP TABLE IF EXISTS ratings;
 DROP TABLE IF EXISTS movies_enriched;
+DROP TABLE IF EXISTS omdb_cache;
 
 CREATE TABLE movies (
     movieId INTEGER PRIMARY KEY,
@@ -15,7 +16,7 @@ CREATE TABLE ratings (
     rating REAL,
     timestamp INTEGER,
     PRIMARY KEY (userId, movieId)
-);
+) WITHOUT ROWID;
 
 CREATE TABLE movies_enriched (
     movieId INTEGER PRIMARY KEY,
@@ -29,3 +30,8 @@ CREATE TABLE movies_enriched (
     imdb_id TEXT,
     other_fields TEXT
 );
+
+CREATE TABLE omdb_cache (
+    key TEXT PRIMARY KEY,
+    val BLOB
+);